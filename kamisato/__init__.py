@@ -13,21 +13,28 @@ from __future__ import annotations
 
 import asyncio
 import contextlib
-import glob
+import hashlib
+import json
 import logging
-import os
 import pathlib
+import queue
 from asyncio.subprocess import Process as AsyncProcess
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 import sys
 from typing import TYPE_CHECKING, TypeVar
 
 import asyncpg
 import discord
-import toml
 from discord.ext import commands
 from discord.utils import MISSING
 
+from .types import BotState
+
+if sys.version_info >= (3, 11):
+    import tomllib
+else:
+    import toml
+
 
 BotT = TypeVar("BotT", bound="Kamisato")
 
@@ -37,32 +44,98 @@ if TYPE_CHECKING:
     from .types import Config as ConfigT
 
 
-__all__ = ['Kamisato', 'Context']
+__all__ = ['Kamisato', 'Context', 'setup_logging', 'stop_logging']
+
+# anything set under [postgresql] in config.toml takes priority over these
+POOL_OPTIONS = {
+    "min_size": 4,
+    "max_size": 20,
+    "statement_cache_size": 256,
+    "max_cached_statement_lifetime": 0
+}
+
+# the only guild synced on startup unless sync_all_commands is set in config.toml
+DEV_GUILD = discord.Object(864774293300838420)
+
+# schema.sql is only replayed when its contents change
+QUERY_CREATE_SCHEMA_MIGRATIONS = """
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    hash TEXT PRIMARY KEY,
+    applied TIMESTAMP NOT NULL DEFAULT (NOW() AT TIME ZONE 'utc')
+);
+"""
+
+QUERY_UPSERT_COMMAND_SYNC = """
+INSERT INTO command_sync (guildid, hash)
+VALUES ($1, $2)
+ON CONFLICT (guildid)
+DO UPDATE
+SET hash=$2;
+"""
+
+# the format below doesn't use any of these, so don't pay for them on every record
+logging.logThreads = False
+logging.logProcesses = False
+logging.logMultiprocessing = False
+
+log_fmt = logging.Formatter("[%(asctime)s %(name)s/%(levelname)s] %(message)s", datefmt="%d/%m/%y-%H:%M:%S")
+
+# file writes and rollovers happen on these listeners' threads rather than the event loop
+_log_listeners: dict[str, QueueListener] = {}
+
+def load_config(path: str = "config.toml") -> ConfigT:
+    if sys.version_info >= (3, 11):
+        with open(path, "rb") as f:
+            return tomllib.load(f)  # type: ignore
+    return toml.load(path)  # type: ignore
 
 def create_logger(name: str, *, stream: bool = False, level: int = logging.DEBUG, size: int = 8 * 1024 * 1024) -> logging.Logger:
     (pathlib.Path.cwd() / "logs").mkdir(exist_ok=True)
 
-    log_fmt = logging.Formatter("[%(asctime)s %(name)s/%(levelname)s] %(message)s", datefmt="%d/%m/%y-%H:%M:%S")
-
     log = logging.getLogger(name)
     log.setLevel(level)
+
+    # calling this again for the same logger would otherwise leak the old file handle
+    previous = _log_listeners.pop(name, None)
+    if previous is not None:
+        previous.stop()
+        for h in previous.handlers:
+            h.close()
     
     hdlr = RotatingFileHandler(f"logs/{name.lower()}.log", maxBytes=size, backupCount=30, encoding="UTF-8")
     hdlr.setFormatter(log_fmt)
-    log.handlers = [hdlr]
+    handlers: list[logging.Handler] = [hdlr]
 
     if stream:
         strm = logging.StreamHandler()
         strm.setFormatter(log_fmt)
-        log.handlers.append(strm)
+        handlers.append(strm)
+
+    q: queue.SimpleQueue[logging.LogRecord] = queue.SimpleQueue()
+    log.handlers = [QueueHandler(q)]
+
+    listener = QueueListener(q, *handlers, respect_handler_level=True)
+    listener.start()
+    _log_listeners[name] = listener
 
     return log
 
-log = create_logger("Kamisato", stream=True)
-create_logger("discord", level=logging.INFO)
+def setup_logging() -> None:
+    # called by the entry point rather than at import, so importing kamisato never opens the log files
+    create_logger("Kamisato", stream=True)
+    create_logger("discord", level=logging.INFO)
+
+def stop_logging() -> None:
+    # only once the event loop has finished, anything logged after this would sit in the queues unwritten
+    for listener in _log_listeners.values():
+        listener.stop()
+
+log = logging.getLogger("Kamisato")
 
 
 class Context(commands.Context[BotT]):
+    __slots__ = ('_pool', '_Context__connection')
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
@@ -74,12 +147,14 @@ class Context(commands.Context[BotT]):
 
     @contextlib.asynccontextmanager
     async def acquire(self, timeout: float = 60.0) -> AsyncGenerator[asyncpg.Connection[asyncpg.Record], None]:
+        # the connection is held for the rest of the command, Kamisato.invoke releases it
         if self.__connection is None:
             self.__connection = await self._pool.acquire(timeout=timeout)  # type: ignore
 
-        try:
-            yield self.__connection  # type: ignore
-        finally:
+        yield self.__connection  # type: ignore
+
+    async def release(self, timeout: float = 60.0) -> None:
+        if self.__connection is not None:
             await self._pool.release(self.__connection, timeout=timeout)  # type: ignore
             self.__connection = None
 
@@ -92,15 +167,16 @@ class Kamisato(commands.Bot):
             help_command=None
         )
 
-        config: ConfigT = toml.load("config.toml")  # type: ignore
-        self.config = config
-        self._all_exts: list[str] = []
+        self.config = load_config()
+        self._all_exts: frozenset[str] = frozenset()
+        self._extensions_version = 0
         self.log = log
 
         self._ssh_tunnel = self.config.get("ssh_tunnel", MISSING)
         self._ssh_tunnel_proc: AsyncProcess = MISSING
 
         self.db: asyncpg.Pool[asyncpg.Record] = MISSING
+        self._state = BotState.INIT
 
     @property
     def application_id(self) -> int | None:
@@ -109,6 +185,25 @@ class Kamisato(commands.Bot):
     async def get_context(self, message: discord.Message, *, cls: type[commands.Context[Kamisato]] = MISSING) -> commands.Context[Kamisato]:
         return await super().get_context(message, cls=cls or Context)
 
+    async def invoke(self, ctx: commands.Context[Kamisato]) -> None:
+        try:
+            await super().invoke(ctx)
+        finally:
+            if isinstance(ctx, Context):
+                await ctx.release()
+
+    async def load_extension(self, name: str, *, package: str | None = None) -> None:
+        await super().load_extension(name, package=package)
+        self._extensions_version += 1
+
+    async def unload_extension(self, name: str, *, package: str | None = None) -> None:
+        await super().unload_extension(name, package=package)
+        self._extensions_version += 1
+
+    async def reload_extension(self, name: str, *, package: str | None = None) -> None:
+        await super().reload_extension(name, package=package)
+        self._extensions_version += 1
+
     async def on_ready(self):
         log.info("Ready[user=%r, guild_count=%d, user_count=%d]", self.user, len(self.guilds), len(self.users))
 
@@ -118,8 +213,9 @@ class Kamisato(commands.Bot):
 
         log.info("Database connected [{user}@{host}:{port}/{database}]".format(**self.config["postgresql"]))
         
-        db: asyncpg.Pool[asyncpg.Record] = await asyncpg.create_pool(**self.config["postgresql"])  # type: ignore
+        db: asyncpg.Pool[asyncpg.Record] = await asyncpg.create_pool(**{**POOL_OPTIONS, **self.config["postgresql"]})  # type: ignore
         self.db = db
+        self._state = BotState.DB_UP
 
         return db
 
@@ -127,13 +223,21 @@ class Kamisato(commands.Bot):
         if self.db is not MISSING:
             log.info("Disconnecting from database...")
 
+            close_task = asyncio.ensure_future(self.db.close())
             try:
-                await asyncio.wait_for(self.db.close(), timeout=60.0)
+                await asyncio.wait_for(asyncio.shield(close_task), timeout=60.0)
             except asyncio.TimeoutError:
                 log.warning("Timed out disconnecting from database.")
                 self.db.terminate()
+                # the graceful close is still running under the shield, don't leave it behind
+                close_task.cancel()
+                await asyncio.wait({close_task})
+                if not close_task.cancelled() and close_task.exception():
+                    log.warning("Database close failed after terminating.", exc_info=close_task.exception())
             finally:
                 self.db = MISSING
+                if self._state != BotState.CLOSING:
+                    self._state = BotState.INIT
 
         await self.stop_ssh_tunnel()
 
@@ -161,26 +265,75 @@ class Kamisato(commands.Bot):
     async def setup_hook(self) -> None:
         db = await self.start_database()
 
-        async with db.acquire() as c, c.transaction():
-            with open("schema.sql", encoding='utf-8') as f:
-                schema = f.read()
-            await c.execute(schema)
+        schema = pathlib.Path("schema.sql").read_bytes()
+        schema_hash = hashlib.sha256(schema).hexdigest()
 
-        for file in pathlib.Path("kamisato/ext").glob("[!_]*"):
-            ext = ".".join(file.parts).removesuffix(".py")
+        async with db.acquire() as c, c.transaction():
+            await c.execute(QUERY_CREATE_SCHEMA_MIGRATIONS)
+            if not await c.fetchval("SELECT 1 FROM schema_migrations WHERE hash=$1;", schema_hash):
+                log.info("Applying schema.sql [%s]", schema_hash)
+                await c.execute(schema.decode("UTF-8"))
+                await c.execute("INSERT INTO schema_migrations (hash) VALUES ($1);", schema_hash)
+
+        all_exts: list[str] = []
+        for file in pathlib.Path("kamisato/ext").glob("[!_]*.py"):
+            ext = f"kamisato.ext.{file.stem}"
             try:
                 await self.load_extension(ext)
             except commands.NoEntryPointError:
                 pass
             else:
-                self._all_exts.append(ext)
-
-        # await self.sync_all_commands()
-        await self.tree.sync(guild=discord.Object(864774293300838420))
+                all_exts.append(ext)
+
+        self._all_exts = frozenset(all_exts)
+
+        # syncing globally from a dev run can overwrite the live commands, so it has to be asked for
+        if self.config.get("sync_all_commands", False):
+            await self.sync_all_commands()
+        else:
+            await self._sync_guild_commands(DEV_GUILD, force=True)
+        self._state = BotState.READY
+
+    async def _sync_guild_commands(self, guild: discord.abc.Snowflake | None, *, force: bool = False) -> list[discord.app_commands.AppCommand] | None:
+        payload = [c.to_dict() for c in self.tree._get_all_commands(guild=guild)]
+        digest = hashlib.sha256(json.dumps(payload, sort_keys=True).encode("UTF-8")).hexdigest()
+        guild_id = guild.id if guild else 0
+
+        # bulk upserts are idempotent but still cost a request, so skip them when nothing changed,
+        # forced syncs still record the hash so later checks compare against what discord actually has
+        if not force and await self.db.fetchval("SELECT 1 FROM command_sync WHERE guildid=$1 AND hash=$2;", guild_id, digest):
+            return None
+
+        synced = await self.tree.sync(guild=guild)
+        await self.db.execute(QUERY_UPSERT_COMMAND_SYNC, guild_id, digest)
+        return synced
+
+    async def sync_all_commands(self) -> None:
+        # global commands plus every guild that has guild-only commands registered
+        guilds: list[discord.Object | None] = [None, *map(discord.Object, self.tree._guild_commands)]
+        results = await asyncio.gather(*[self._sync_guild_commands(g) for g in guilds], return_exceptions=True)
+
+        for guild, result in zip(guilds, results):
+            if isinstance(result, BaseException):
+                log.error("Failed to sync commands for guild %s", guild and guild.id, exc_info=result)
+            elif result is None:
+                log.info("Commands for guild %s are unchanged, skipped syncing", guild and guild.id)
+            else:
+                log.info("Synced %d commands for guild %s", len(result), guild and guild.id)
 
     async def close(self) -> None:
+        if self._state == BotState.CLOSING:
+            return
+
+        # marked before awaiting anything so an overlapping close() returns above
+        db_up = self._state in (BotState.DB_UP, BotState.READY)
+        self._state = BotState.CLOSING
+
         log.info("Close accepted, shutting down.")
-        await self.stop_database()
-        
+        if db_up:
+            await self.stop_database()
+        else:
+            await self.stop_ssh_tunnel()
+
         await super().close()
 
@@ -10,7 +10,22 @@ You should have received a copy of the GNU Affero General Public License along w
 """
 
 if __name__ == '__main__':
-    from . import Kamisato
+    import asyncio
+    import sys
 
+    from . import Kamisato, setup_logging, stop_logging
+
+    if sys.platform != "win32":
+        try:
+            import uvloop
+        except ImportError:
+            pass
+        else:
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+
+    setup_logging()
     bot = Kamisato()
-    bot.run(bot.config['discord']['token'])
+    try:
+        bot.run(bot.config['discord']['token'])
+    finally:
+        stop_logging()
@@ -12,88 +12,147 @@ You should have received a copy of the GNU Affero General Public License along w
 from __future__ import annotations
 
 import asyncio
-import itertools
+import functools
 import json
+import pathlib
 from typing import TYPE_CHECKING
 
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
 import discord
 from discord import app_commands
 from discord.ext import commands
-from discord.utils import MISSING
 
-# from pprint import pprint as print
+from kamisato.types import Rarity, artifact_slots
 
 if TYPE_CHECKING:
-    from typing import Any
-
     from kamisato import Kamisato
-    from kamisato.types import Rarity, ScanData, _ScanData_Artifacts_Artifact
+    from kamisato.types import ScanData, _ScanData_Artifacts_Artifact
 
     ArtifactSubstatDataT = dict[str, dict[str, list[float]]]
 
+
+MAX_SCAN_BYTES = 8 * 1024 * 1024
+
+QUERY_RESERVE_ARTIFACT_IDS = """
+SELECT nextval(pg_get_serial_sequence('artifacts', 'uuid'))
+    FROM generate_series(1, $1);
+"""
+
+
+@functools.lru_cache(maxsize=1)
+def _load_substat_data() -> ArtifactSubstatDataT:
+    return json_loads(pathlib.Path("GenshinData/Kamisato_Formatted/artifact_substats.json").read_bytes())
+
+
+def convert_artifact_substats_to_rolls(artifact: _ScanData_Artifacts_Artifact, *, rarity: Rarity) -> dict[str, list[int]]:
+    stats: dict[str, list[float]] = _load_substat_data()[str(rarity)]
+    rolls: dict[str, list[int]] = {}
+
+    for sub in artifact["substats"]:
+        stat: str
+        v: float
+        stat, v = sub.values()  # type: ignore
+        is_percent = stat.endswith("_")
+        possible = stats[stat]
+        if is_percent:
+            possible = [k * 100 for k in possible]
+
+        # work on scaled integers so summing rolls doesn't accumulate float error,
+        # the displayed value is rounded so anything within half a digit matches
+        digits = 1 if is_percent else 0
+        ipossible = [int(round(k * 1000)) for k in possible]
+        ilow = int(round((v - 0.5 / 10 ** digits) * 1000))
+        ihigh = int(round((v + 0.5 / 10 ** digits) * 1000))
+        # a substat starts with one roll and gains at most one per upgrade, so bound the search by that
+        # rather than by the (user supplied) value, and reject anything that can't be reached at all
+        max_rolls = min(ihigh // min(ipossible), rarity.get_max_artifact_upgrade_count() + 1)
+        if ilow > max_rolls * max(ipossible):
+            raise ValueError(f"{stat} value {v} is out of range for a {rarity} star artifact")
+
+        # dp maps a scaled sum to every roll index combination that reaches it,
+        # roll order doesn't matter so indices are only ever appended in ascending order
+        dp: dict[int, list[tuple[int, ...]]] = {0: [()]}
+        for _ in range(max_rolls):
+            layer: dict[int, list[tuple[int, ...]]] = {}
+            for total, combos in dp.items():
+                for i, k in enumerate(ipossible):
+                    s = total + k
+                    if s >= ihigh:
+                        continue
+                    extended = [c + (i,) for c in combos if not c or c[-1] <= i]
+                    if extended:
+                        layer.setdefault(s, []).extend(extended)
+            dp = layer
+
+            found = next((combos[0] for total, combos in dp.items() if total >= ilow), None)
+            if found is not None:
+                rolls[stat] = list(found)
+                break
+        else:
+            raise ValueError(f"{stat} value {v} doesn't match any roll combination for a {rarity} star artifact")
+
+    return rolls
+
+
+def _process_scan_blocking(artifacts: list[_ScanData_Artifacts_Artifact]) -> list[tuple[_ScanData_Artifacts_Artifact, dict[str, list[int]]]]:
+    # runs in a worker thread, the roll search is bounded per substat so this stays short
+    return [
+        (artifact, convert_artifact_substats_to_rolls(artifact, rarity=Rarity(artifact["rarity"])))
+        for artifact in artifacts
+    ]
+
+
 class Data(commands.Cog):
     data = app_commands.Group(name="data", description="Configure your Genshin Impact data.")
 
     def __init__(self, bot: Kamisato):
         self.bot = bot
 
-        self._artifact_substat_data: ArtifactSubstatDataT = MISSING
-
-    def convert_artifact_substats_to_rolls(self, artifact: _ScanData_Artifacts_Artifact, *, rarity: Rarity) -> dict[str, list[int]]:
-        if not self._artifact_substat_data:
-            with open("GenshinData/Kamisato_Formatted/artifact_substats.json") as f:
-                self._artifact_substat_data: ArtifactSubstatDataT = json.load(f)
-
-        stats: dict[str, list[float]] = self._artifact_substat_data[str(rarity)]
-        rolls: dict[str, list[int]] = {}
-
-        for sub in artifact["substats"]:
-            stat: str
-            v: float
-            stat, v = sub.values()  # type: ignore
-            is_percent = stat.endswith("_")
-            possible = stats[stat]
-            if is_percent:
-                possible = [k * 100 for k in possible]
-
-            for n in itertools.product(possible, repeat=int(v // possible[0])):
-                print("test", v, n, round(sum(n), is_percent))
-                total = round(sum(n), is_percent)
-                if total == v:
-                    rolls[stat] = [{j: i for i, j in enumerate(possible)}[k] for k in n]
-        
-        return rolls
+    async def save_data(self, user_id: int, data: ScanData) -> tuple[int, int, int]:
+        artifacts = await asyncio.to_thread(_process_scan_blocking, data.get("artifacts", []))
 
-    async def save_data(self, data: ScanData) -> tuple[int, int, int]:
-        # await asyncio.sleep(5)
+        async with self.bot.db.acquire() as c, c.transaction():
+            # reserve the ids up front so both tables can be bulk copied without a RETURNING per artifact
+            uuids: list[int] = [r[0] for r in await c.fetch(QUERY_RESERVE_ARTIFACT_IDS, len(artifacts))]
 
-        roll_data: dict[str, list[int]]
-        roll_data, _ = MISSING  # TODO
+            artifact_rows: list[tuple[int, int, str, int, int, int]] = []
+            substat_rows: list[tuple[int, str, list[int]]] = []
 
-        artifacts: list[Any] = []
-        
-        async with self.bot.db.acquire() as c, c.transaction():
-            for artifact in artifacts:
-                pass
+            for uuid, (artifact, rolls) in zip(uuids, artifacts):
+                slot = artifact_slots.index(artifact["slotKey"])
+                artifact_rows.append((uuid, user_id, artifact["setKey"], slot, artifact["rarity"], artifact["level"]))
+                substat_rows.extend((uuid, stat, r) for stat, r in rolls.items())
+
+            await c.copy_records_to_table("artifacts", records=artifact_rows, columns=("uuid", "userid", "set", "slot", "rarity", "level"))
+            await c.copy_records_to_table("artifact_substats", records=substat_rows, columns=("uuid", "stat", "rolls"))
 
-        return 0, 0, 0
+        return len(artifact_rows), 0, 0
 
     @data.command(name="import")
     async def _import(self, interaction: discord.Interaction, data: discord.Attachment) -> None:
         """Imports your scanned data from a JSON encoded file."""
         await interaction.response.defer(ephemeral=True, thinking=True)
 
+        if data.size > MAX_SCAN_BYTES:
+            await interaction.followup.send(f"That file is too large, scans must be under {MAX_SCAN_BYTES // 1024 // 1024} MiB.")
+            return
+
         read = await data.read()
 
         try:
-            dat: ScanData = json.loads(read)
-        except json.JSONDecodeError:
+            dat: ScanData = await asyncio.to_thread(json_loads, read)
+        except json.JSONDecodeError:  # orjson's error subclasses this
             await interaction.followup.send("An error occured decoding the file. Double check your input and try again.")
             return
         
         try:
-            artifacts, weapons, characters = await self.save_data(dat)
-        except ValueError as err:
+            artifacts, weapons, characters = await self.save_data(interaction.user.id, dat)
+        except (ValueError, KeyError, TypeError) as err:
+            # malformed artifacts (unknown stat keys, missing fields) surface as any of these
             await interaction.followup.send(f"An error occured saving the data. Double check your input and try again.\nDebug: `{err}`")
             return
 
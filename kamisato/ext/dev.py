@@ -13,28 +13,37 @@ from __future__ import annotations
 
 import ast
 import asyncio, asyncio.subprocess
+import bisect
+import collections
+import copy
+import csv
 import io
-import re
+import logging
 import textwrap
 import traceback
 import sys
-from typing import Optional, TYPE_CHECKING
+from typing import Optional, TYPE_CHECKING, TypeVar
 
 import discord
 from discord import app_commands as ac, ui, utils
 from discord.ext import commands
-from tabulate import tabulate
 
 from kamisato.util import MergeStream, Paginator, ReactivePaginator
 
 if TYPE_CHECKING:
-    from typing import Any, Awaitable, Callable, Generator
+    from types import CodeType
+    from typing import Any, Awaitable, Callable, Generator, Sequence
+
+    import asyncpg
 
     from kamisato import Kamisato
 
 
 CLOSET_ID = 864774293300838420
 MAYA_ID = 455289384187592704
+EVAL_CACHE_SIZE = 64
+
+T = TypeVar("T")
 
 
 def trim(text: str, *, max: int = utils.MISSING, code_block: bool = False, end: str = "…") -> str:
@@ -50,13 +59,96 @@ def trim(text: str, *, max: int = utils.MISSING, code_block: bool = False, end:
     return trimmed
 
 
-REMOVE_CODEBLOCK = re.compile(r"```([a-zA-Z\-]+)?([\s\S]+?)```")
+def format_grid(records: Sequence[asyncpg.Record]) -> str:
+    if not records:
+        return ""
+
+    keys = list(records[0].keys())
+    rows = [["null" if v is None else str(v) for v in r.values()] for r in records]
+
+    widths = [len(k) for k in keys]
+    for row in rows:
+        for i, v in enumerate(row):
+            if len(v) > widths[i]:
+                widths[i] = len(v)
+
+    border = "+" + "+".join("-" * (w + 2) for w in widths) + "+\n"
+    out = io.StringIO()
+    out.write(border)
+    out.write("| " + " | ".join(k.ljust(w) for k, w in zip(keys, widths)) + " |\n")
+    out.write(border.replace("-", "="))
+    for row in rows:
+        out.write("| " + " | ".join(v.ljust(w) for v, w in zip(row, widths)) + " |\n")
+    out.write(border.rstrip())
+
+    return out.getvalue()
+
+
+def format_csv(records: Sequence[asyncpg.Record]) -> str:
+    out = io.StringIO()
+    writer = csv.writer(out)
+    if records:
+        writer.writerow(records[0].keys())
+        writer.writerows(r.values() for r in records)
+    return out.getvalue()
+
+
 def remove_codeblock(text: str) -> tuple[str | None, str]:
-    find = REMOVE_CODEBLOCK.match(text)
-    if not find:
+    if not text.startswith("```"):
+        return None, text
+
+    body, fence, _ = text[3:].rpartition("```")
+    if not fence or not body:
         return None, text
-    lang, txt = find.groups()
-    return lang, txt
+
+    lang, newline, rest = body.partition("\n")
+    if newline and lang and all(c.isascii() and (c.isalpha() or c == "-") for c in lang):
+        return lang, rest
+    return None, body
+
+
+def compile_eval(source: str) -> CodeType:
+    code = f"async def _ka_eval_func0():\n{textwrap.indent(source, '    ')}"
+
+    # if we don't specify `return` in our eval code, then we can inject it directly
+    parse: ast.Module = ast.parse(code)
+    astfunc: ast.AsyncFunctionDef = parse.body[0]  # type: ignore
+    ret = astfunc.body[-1]
+    if not isinstance(ret, ast.Return):
+        astfunc.body[-1] = ast.copy_location(ast.Return(ret.value), ret)  # type: ignore
+
+    return compile(ast.fix_missing_locations(parse), "<eval>", "exec")
+
+
+def compile_sql_arg(source: str) -> Callable[[dict[str, Any]], Any]:
+    # most arguments are plain literals, which don't need compiling or a frame to evaluate
+    try:
+        value = ast.literal_eval(source)
+    except (ValueError, TypeError, SyntaxError):
+        code = compile(source, "<sql-arg>", "eval")
+        return lambda env: eval(code, env, {})
+
+    # the compiled argument is cached, so containers are copied to keep one run's mutations out of the next
+    if isinstance(value, (str, bytes, int, float, complex, bool, type(None))):
+        return lambda env: value
+    return lambda env: copy.deepcopy(value)
+
+
+def cached_compile(cache: collections.OrderedDict[str, T], source: str, compiler: Callable[[str], T]) -> T:
+    try:
+        cache.move_to_end(source)
+    except KeyError:
+        cache[source] = compiler(source)
+        if len(cache) > EVAL_CACHE_SIZE:
+            cache.popitem(last=False)
+    return cache[source]
+
+
+def filter_sorted(names: tuple[str, ...], current: str) -> list[str]:
+    # prefix matches are a contiguous slice of the sorted names, everything else needs a substring scan
+    lo = bisect.bisect_left(names, current)
+    hi = bisect.bisect_left(names, current + "\U0010ffff", lo)
+    return [*names[lo:hi], *[k for k in names[:lo] + names[hi:] if current in k]]
 
 
 def full_command_name(command: ac.Command[Any, Any, Any] | ac.Group) -> Generator[str, Any, Any]:
@@ -65,6 +157,14 @@ def full_command_name(command: ac.Command[Any, Any, Any] | ac.Group) -> Generato
     yield command.name
 
 
+def cached_full_command_name(command: ac.Command[Any, Any, Any] | ac.Group) -> str:
+    try:
+        return command._ka_full_name  # type: ignore
+    except AttributeError:
+        name = command._ka_full_name = " ".join(full_command_name(command))  # type: ignore
+        return name
+
+
 class EvalModal(ui.Modal):
     def __init__(self, *, title: str, sql: bool = False, prev_code: str | None = None, prev_extras: str | None = None):
         super().__init__(title=title)
@@ -96,9 +196,36 @@ class Developers(commands.Cog, ac.Group):
         self._last_sql: str | None = None
         self._last_sql_args: str | None = None
 
+        self._eval_cache: collections.OrderedDict[str, Callable[[], Awaitable[Any]]] = collections.OrderedDict()
+        self._sql_arg_cache: collections.OrderedDict[str, Callable[[dict[str, Any]], Any]] = collections.OrderedDict()
+
+        self._ext_index: tuple[tuple[str, ...], tuple[str, ...]] = ((), ())
+        self._ext_index_version = -1
+
+    async def cog_load(self) -> None:
+        jit = getattr(sys, "_jit", None)
+        if jit is not None and jit.is_enabled():
+            self.bot.log.info("CPython JIT is enabled, repeated evals will be specialized")
+
     async def interaction_check(self, interaction: discord.Interaction) -> bool:
         return interaction.user.id == MAYA_ID
 
+    def _make_eval_func(self, source: str) -> Callable[[], Awaitable[Any]]:
+        # the function object is kept (not just its code) so repeat runs reuse the same specialized function,
+        # its globals are _eval_globals so `interaction` and `_` are always current
+        lcls: dict[str, Any] = {}
+        exec(compile_eval(source), self._eval_globals, lcls)
+        return lcls["_ka_eval_func0"]
+
+    def _extension_index(self) -> tuple[tuple[str, ...], tuple[str, ...]]:
+        # (loaded, unloaded), only rebuilt when an extension is (un/re)loaded
+        if self._ext_index_version != self.bot._extensions_version:
+            loaded = tuple(sorted(self.bot.extensions))
+            unloaded = tuple(sorted(self.bot._all_exts.difference(loaded)))
+            self._ext_index = (loaded, unloaded)
+            self._ext_index_version = self.bot._extensions_version
+        return self._ext_index
+
     @commands.Cog.listener()
     async def on_interaction(self, interaction: discord.Interaction) -> None:
         if interaction.type is not discord.InteractionType.application_command:
@@ -109,8 +236,11 @@ class Developers(commands.Cog, ac.Group):
             self.bot.log.warning("Received command '%s' which was not found", name)
             return
         
-        command_name = " ".join(full_command_name(interaction.command))  # type: ignore
-        command_args = " ".join([f"{k}: {v!r}" for k, v in interaction.namespace.__dict__.items()])
+        if not self.bot.log.isEnabledFor(logging.INFO):
+            return
+
+        command_name = cached_full_command_name(interaction.command)  # type: ignore
+        command_args = " ".join(f"{k}: {v!r}" for k, v in interaction.namespace.__dict__.items())
 
         self.bot.log.info(
             "[%s/#%s/%s]: /%s %s", 
@@ -130,15 +260,15 @@ class Developers(commands.Cog, ac.Group):
         fail: list[str] = []
 
         if not extension:
-            for ext in self.bot._all_exts:
-                if ext not in self.bot.extensions:
-                    try:
-                        await self.bot.load_extension(ext)
-                    except Exception as e:
-                        self.bot.log.exception("Failed to load extension '%s'", ext, exc_info=e)
-                        fail.append(f'{ext}: {e}')
-                    else:
-                        success.append(ext)
+            exts = sorted(self.bot._all_exts - self.bot.extensions.keys())
+            results = await asyncio.gather(*[self.bot.load_extension(ext) for ext in exts], return_exceptions=True)
+
+            for ext, result in zip(exts, results):
+                if isinstance(result, BaseException):
+                    self.bot.log.exception("Failed to load extension '%s'", ext, exc_info=result)
+                    fail.append(f'{ext}: {result}')
+                else:
+                    success.append(ext)
         else:
             try:
                 await self.bot.load_extension(extension)
@@ -158,8 +288,8 @@ class Developers(commands.Cog, ac.Group):
 
     @load.autocomplete("extension")
     async def _load_autocomplete(self, interaction: discord.Interaction, current: str) -> list[ac.Choice[str]]:
-        unloaded = sorted(set(self.bot._all_exts) - set(self.bot.extensions.keys()))
-        return [ac.Choice(name=k, value=k) for k in unloaded if current in k]
+        _, unloaded = self._extension_index()
+        return [ac.Choice(name=k, value=k) for k in filter_sorted(unloaded, current)]
 
     @cog.command()
     async def reload(self, interaction: discord.Interaction, extension: str) -> None:
@@ -174,13 +304,12 @@ class Developers(commands.Cog, ac.Group):
 
     @reload.autocomplete("extension")
     async def _reload_autocomplete(self, interaction: discord.Interaction, current: str) -> list[ac.Choice[str]]:
-        exts = list(self.bot.extensions.keys())
-        return [ac.Choice(name=k, value=k) for k in sorted(exts) if current in k]
+        loaded, _ = self._extension_index()
+        return [ac.Choice(name=k, value=k) for k in filter_sorted(loaded, current)]
 
     @cog.command()
     async def list(self, interaction: discord.Interaction) -> None:
-        loaded = self.bot.extensions.keys()
-        unloaded = set(self.bot._all_exts) - set(loaded)
+        loaded, unloaded = self._extension_index()
         embed = discord.Embed(colour=discord.Colour.og_blurple())
         embed.add_field(name="\U0001f4e5", value="\n".join(loaded))
         if unloaded:
@@ -201,13 +330,13 @@ class Developers(commands.Cog, ac.Group):
         await interaction.response.defer(ephemeral=True, thinking=True)
 
         try:
-            commands = await self.bot.tree.sync(guild=guild)
+            commands = await self.bot._sync_guild_commands(guild, force=True)
         except discord.HTTPException as e:
             exc = "".join(traceback.format_exception(type(e), e, e.__traceback__))
             trimmed = trim(exc, code_block=True, max=1850)
             await interaction.followup.send(f"Failed to sync commands.\n{trimmed}")
         else:
-            await interaction.followup.send(f"Synced `{len(commands)}` commands successfully.")
+            await interaction.followup.send(f"Synced `{len(commands or ())}` commands successfully.")
 
     @ac.command()
     async def shutdown(self, interaction: discord.Interaction):
@@ -227,7 +356,8 @@ class Developers(commands.Cog, ac.Group):
 
         args: list[Any]
         if modal.extras.value:
-            args = [eval(a.strip(), {"interaction": interaction, "bot": self.bot}, {}) for a in modal.extras.value.split(";")]
+            env = {"interaction": interaction, "bot": self.bot}
+            args = [cached_compile(self._sql_arg_cache, a.strip(), compile_sql_arg)(env) for a in modal.extras.value.split(";")]
         else:
             args = []
 
@@ -238,9 +368,10 @@ class Developers(commands.Cog, ac.Group):
             await modal.interaction.followup.send(f"```sql\n{e}\n```")
             return
         
-        fmt = tabulate(result, headers="keys", missingval="null", tablefmt="grid") or "\u200b"
+        fmt = format_grid(result) or "\u200b"
         if len(fmt) > 1900:
-            await modal.interaction.followup.send("Output too long...", file=discord.File(io.BytesIO(fmt.encode("UTF-8"))))
+            csv_file = discord.File(io.BytesIO(format_csv(result).encode("UTF-8")), filename="result.csv")
+            await modal.interaction.followup.send("Output too long...", file=csv_file)
         else:
             await modal.interaction.followup.send(f"```sql\n{fmt}\n```")
 
@@ -253,28 +384,16 @@ class Developers(commands.Cog, ac.Group):
         
         await modal.interaction.response.defer(ephemeral=True, thinking=True)
         self._last_eval = modal.code.value
-        code = f"async def _ka_eval_func0():\n{textwrap.indent(modal.code.value, '    ')}"  # type: ignore
-
-        # if we don't specify `return` in our eval code, then we can inject it directly
-        parse: ast.Module = ast.parse(code)
-        astfunc: ast.AsyncFunctionDef = parse.body[0]  # type: ignore
-        ret = astfunc.body[-1]
-        if not isinstance(ret, ast.Return):
-            astfunc.body[-1] = ast.Return(ret.value)  # type: ignore
-        
-        code = ast.unparse(parse)
 
         self._eval_globals["interaction"] = interaction
 
-        lcls = {}
         try:
-            exec(code, self._eval_globals, lcls)
+            func = cached_compile(self._eval_cache, modal.code.value, self._make_eval_func)  # type: ignore
         except Exception as e:
             fmt = "".join(traceback.format_exception(type(e), e, e.__traceback__))
             await modal.interaction.followup.send(f"```py\n{fmt}\n```")
             return
         
-        func: Callable[[], Awaitable[Any]] = lcls.pop("_ka_eval_func0")
         try:
             result = await func()
         except Exception as e:
@@ -303,8 +422,8 @@ class Developers(commands.Cog, ac.Group):
 
         pg = Paginator(max_size=1900, prefix="```" + shell, suffix="```")
 
-        async for line in MergeStream(proc):
-            pg.appendln(line)
+        lines = [f"{line}\n" async for line in MergeStream(proc)]
+        pg.extend(lines)
         self.bot.log.debug(f"pages: {len(pg.pages)}")
         
         await modal.interaction.followup.send(content=pg.pages[0], view=ReactivePaginator(pg, allowed_users={interaction.user.id}))
@@ -11,7 +11,9 @@ You should have received a copy of the GNU Affero General Public License along w
 
 from __future__ import annotations
 
+import asyncio
 import datetime
+import functools
 import json
 import zoneinfo
 from typing import Literal, TYPE_CHECKING
@@ -34,45 +36,88 @@ timezones: dict[str, zoneinfo.ZoneInfo] = {
     "europe": zoneinfo.ZoneInfo("Etc/GMT-1")
 }
 
-UTC = zoneinfo.ZoneInfo("Etc/UTC")
-
-item_emoji: dict[str, discord.PartialEmoji] = {
-    "Freedom": discord.PartialEmoji(name='freedom', id=956865112763924541, animated=False),
-    "Prosperity": discord.PartialEmoji(name='prosperity', id=956865128094126080, animated=False),
-    "Transience": discord.PartialEmoji(name='transience', id=956865136562421781, animated=False),
-    "Ballad": discord.PartialEmoji(name='ballad', id=956865099958734918, animated=False),
-    "Gold": discord.PartialEmoji(name='gold', id=956865117574795294, animated=False),
-    "Light": discord.PartialEmoji(name='light', id=956865121114812427, animated=False),
-    "Resistance": discord.PartialEmoji(name='resistance', id=956865132556869652, animated=False),
-    "Diligence": discord.PartialEmoji(name='diligence', id=956865104325001277, animated=False),
-    "Elegance": discord.PartialEmoji(name='elegance', id=956865107739152384, animated=False),
-
-    "Decarabian": discord.PartialEmoji(name='decarabian', id=956866862103269376, animated=False),
-    "Guyun": discord.PartialEmoji(name='guyun', id=956867348172767232, animated=False),
-    "Distant Sea": discord.PartialEmoji(name='distant_sea', id=956867025215578122, animated=False),
-    "Boreal Wolf": discord.PartialEmoji(name='boreal_wolf', id=956866795380281344, animated=False),
-    "Mist Veiled Elixir": discord.PartialEmoji(name='mist_veiled', id=956867227540414494, animated=False),
-    "Narukami": discord.PartialEmoji(name='narukami', id=956867292761841664, animated=False),
-    "Dandelion Gladiator": discord.PartialEmoji(name='dand_gladiator', id=956867415503933460, animated=False),
-    "Aerosiderite": discord.PartialEmoji(name='aerosiderite', id=956866711930433567, animated=False),
-    "Mask": discord.PartialEmoji(name='mask', id=956867093729513492, animated=False),
+UTC = datetime.timezone.utc
+
+RESET_TIME = datetime.time(4)
+ONE_DAY = datetime.timedelta(days=1)
+
+# (name, id, animated), the PartialEmoji objects are only built when first needed
+item_emoji: dict[str, tuple[str, int, bool]] = {
+    "Freedom": ('freedom', 956865112763924541, False),
+    "Prosperity": ('prosperity', 956865128094126080, False),
+    "Transience": ('transience', 956865136562421781, False),
+    "Ballad": ('ballad', 956865099958734918, False),
+    "Gold": ('gold', 956865117574795294, False),
+    "Light": ('light', 956865121114812427, False),
+    "Resistance": ('resistance', 956865132556869652, False),
+    "Diligence": ('diligence', 956865104325001277, False),
+    "Elegance": ('elegance', 956865107739152384, False),
+
+    "Decarabian": ('decarabian', 956866862103269376, False),
+    "Guyun": ('guyun', 956867348172767232, False),
+    "Distant Sea": ('distant_sea', 956867025215578122, False),
+    "Boreal Wolf": ('boreal_wolf', 956866795380281344, False),
+    "Mist Veiled Elixir": ('mist_veiled', 956867227540414494, False),
+    "Narukami": ('narukami', 956867292761841664, False),
+    "Dandelion Gladiator": ('dand_gladiator', 956867415503933460, False),
+    "Aerosiderite": ('aerosiderite', 956866711930433567, False),
+    "Mask": ('mask', 956867093729513492, False),
 }
 
-elements: dict[str, discord.PartialEmoji] = {
-    "hydro": discord.PartialEmoji(name='hydro', id=956871937303388210, animated=False),
-    "pyro": discord.PartialEmoji(name='pyro', id=956871942835679252, animated=False),
-    "anemo": discord.PartialEmoji(name='anemo', id=956871949945024542, animated=False),
-    "cryo": discord.PartialEmoji(name='cryo', id=956871955275972608, animated=False),
-    "dendro": discord.PartialEmoji(name='dendro', id=956871961244475442, animated=False),
-    "electro": discord.PartialEmoji(name='electro', id=956871966810325013, animated=False),
-    "geo": discord.PartialEmoji(name='geo', id=956871972971765810, animated=False),
+elements: dict[str, tuple[str, int, bool]] = {
+    "hydro": ('hydro', 956871937303388210, False),
+    "pyro": ('pyro', 956871942835679252, False),
+    "anemo": ('anemo', 956871949945024542, False),
+    "cryo": ('cryo', 956871955275972608, False),
+    "dendro": ('dendro', 956871961244475442, False),
+    "electro": ('electro', 956871966810325013, False),
+    "geo": ('geo', 956871972971765810, False),
 }
 
+
+@functools.lru_cache(maxsize=None)
+def get_item_emoji(key: str) -> discord.PartialEmoji:
+    name, id, animated = item_emoji[key]
+    return discord.PartialEmoji(name=name, id=id, animated=animated)
+
+
+@functools.lru_cache(maxsize=None)
+def get_element_emoji(key: str) -> discord.PartialEmoji:
+    name, id, animated = elements[key]
+    return discord.PartialEmoji(name=name, id=id, animated=animated)
+
+
+def load_daily_data() -> DailyData:
+    with open("kamisato/data/daily.json") as f:
+        return json.load(f)
+
+
+def build_today_fields(daily_data: DailyData) -> list[list[tuple[str, str, bool]]]:
+    # (name, value, inline) embed fields for each weekday, sunday has every domain open
+    fields: list[list[tuple[str, str, bool]]] = []
+
+    for talents, weapons in zip(daily_data["domains"]["talent"], daily_data["domains"]["weapon"]):
+        day: list[tuple[str, str, bool]] = []
+        for t in talents:
+            characters = "\n".join([f"{get_element_emoji(v)} {k}" for k, v in daily_data["talent_books"][t].items()])
+            day.append((f'{get_item_emoji(t)} {t}', characters, True))
+
+        weapon_fmt = [f"{get_item_emoji(w)} {w}" for w in weapons]
+        day.append(("Weapon Materials", "\n".join(weapon_fmt), False))
+        fields.append(day)
+
+    fields.append([("Talent Books", "All!", False), ("Weapon Materials", "All!", False)])
+    return fields
+
+
 class Miscellaneous(commands.Cog):
-    def __init__(self, bot: Kamisato):
+    def __init__(self, bot: Kamisato, daily_data: DailyData):
         self.bot = bot
-        with open("kamisato/data/daily.json") as f:
-            self.daily_data: DailyData = json.load(f)
+        self.daily_data = daily_data
+        self._today_fields = build_today_fields(daily_data)
+
+        # only /server update changes this, and it writes through
+        self._server_cache: dict[int, str] = {}
 
     server = ac.Group(name="server", description="Genshin Impact server-related commands.", guild_ids=[639770490755612672])
 
@@ -96,42 +141,38 @@ class Miscellaneous(commands.Cog):
             """
             await c.execute(q, interaction.user.id, region.value)
 
+        self._server_cache[interaction.user.id] = region.value
+
         await interaction.response.send_message(f"Updated server to: {region.name}", ephemeral=True)
 
     @server.command()
     async def today(self, interaction: discord.Interaction) -> None:
         """Shows information about what is available today (domains etc)."""
 
-        server: str = await self.bot.db.fetchval("SELECT server FROM user_config WHERE userid=$1;", interaction.user.id) or "america"
+        server = self._server_cache.get(interaction.user.id)
+        if server is None:
+            server = await self.bot.db.fetchval("SELECT server FROM user_config WHERE userid=$1;", interaction.user.id)
+            if server is not None:
+                self._server_cache[interaction.user.id] = server
+        server = server or "america"
         timezone = timezones[server]
         today = datetime.datetime.now(timezone)
 
         if today.hour < 4:
-            today -= datetime.timedelta(days=1)
+            today -= ONE_DAY
             
-        reset = datetime.datetime(today.year, today.month, today.day + 1, 4, 0, 0, 0, timezone).astimezone(UTC)
+        reset = datetime.datetime.combine((today + ONE_DAY).date(), RESET_TIME, timezone).astimezone(UTC)
 
         embed = discord.Embed(title="Available Today", colour=discord.Colour.og_blurple())
         embed.description = f"Resets {utils.format_dt(reset, 'R')}"
 
-        if today.weekday() == 6:
-            embed.add_field(name="Talent Books", value="All!", inline=False)
-            embed.add_field(name="Weapon Materials", value="All!", inline=False)
-        else:
-            talents = self.daily_data["domains"]["talent"][today.weekday()]
-            for t in talents:
-                characters = "\n".join([f"{elements[v]} {k}" for k, v in self.daily_data["talent_books"][t].items()])
-                embed.add_field(name=f'{item_emoji[t]} {t}', value=characters, inline=True)
-            
-            weapons = self.daily_data["domains"]["weapon"][today.weekday()]
-
-            weapon_fmt = [f"{item_emoji[w]} {w}" for w in weapons]
-
-            embed.add_field(name="Weapon Materials", value="\n".join(weapon_fmt), inline=False)
+        for name, value, inline in self._today_fields[today.weekday()]:
+            embed.add_field(name=name, value=value, inline=inline)
 
         embed.set_footer(text=f"Server: {server.title()}")
         await interaction.response.send_message(embed=embed)
 
 
 async def setup(bot: Kamisato):
-    await bot.add_cog(Miscellaneous(bot))
+    daily_data = await asyncio.to_thread(load_daily_data)
+    await bot.add_cog(Miscellaneous(bot, daily_data))
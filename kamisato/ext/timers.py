@@ -13,78 +13,143 @@ from __future__ import annotations
 
 import asyncio
 import datetime
-import itertools
-import zoneinfo
-from typing import TYPE_CHECKING
+import heapq
+from typing import TYPE_CHECKING, Any, Coroutine
 
 import asyncpg
 import discord
-from asyncpg.exceptions import ForeignKeyViolationError, UniqueViolationError, PostgresConnectionError
+from asyncpg.exceptions import UniqueViolationError, PostgresConnectionError
 from discord import app_commands as ac, utils, ui
-from discord.ext import commands, tasks
+from discord.ext import commands
 
-from kamisato.ext.misc import timezones
+from kamisato.ext.misc import UTC, timezones
 
 if TYPE_CHECKING:
     from kamisato import Kamisato
 
 
-QUERY_DELETE_REMINDER = """
-DELETE FROM {0}_reminder
-    USING user_config
-WHERE {0}_reminder.userid = user_config.userid
-    AND NOT repeat
-    AND user_config.server = $1;
+# (server, timezone) pairs, shared with misc so the two can't drift apart
+_RESET_ZONES = tuple(timezones.items())
+
+_DAILY_KINDS = ["daily"]
+_WEEKLY_KINDS = ["daily", "weekly"]
+
+_fmt_mention = "<@!{}>".format
+
+_DAILY_MSG = {
+    "america": "the America server dailies have reset!",
+    "asia": "the Asia server dailies have reset!",
+    "europe": "the Europe server dailies have reset!"
+}
+_WEEKLY_MSG = {
+    "america": "the America server weeklies (and dailies) have reset!",
+    "asia": "the Asia server weeklies (and dailies) have reset!",
+    "europe": "the Europe server weeklies (and dailies) have reset!"
+}
+
+QUERY_PURGE_REMINDERS = """
+DELETE FROM reminders
+WHERE server = $1
+    AND kind = ANY($2::text[])
+    AND NOT repeat;
 """
-QUERY_SELECT_REMINDER = """
-SELECT {0}_reminder.userid, {0}_reminder.channelid
-    FROM {0}_reminder 
-LEFT JOIN user_config
-    ON user_config.userid = {0}_reminder.userid
-WHERE user_config.server = $1;
+# a user with both kinds set in the same channel is only mentioned once
+QUERY_SELECT_REMINDERS = """
+SELECT channelid, array_agg(DISTINCT userid)
+    FROM reminders
+WHERE server = $1
+    AND kind = ANY($2::text[])
+GROUP BY channelid;
 """
+# inserts nothing and returns NULL if the user has no config yet
 QUERY_INSERT_REMINDER = """
-WITH {0} AS (
-    INSERT INTO {0}_reminder 
-    (userid, repeat, channelid)
-    VALUES ($1, $2, $3)
-    RETURNING {0}_reminder.userid
-)
-SELECT server
+INSERT INTO reminders
+(userid, kind, repeat, channelid, server)
+SELECT $1, $2, $3, $4, server
     FROM user_config
-INNER JOIN {0}
-    ON user_config.userid = {0}.userid;
+WHERE userid = $1
+RETURNING server;
+"""
+QUERY_DELETE_REMINDER = """
+DELETE FROM reminders
+WHERE userid = $1
+    AND kind = $2;
+"""
+QUERY_DELETE_DEAD_CHANNELS = """
+DELETE FROM reminders
+WHERE channelid = ANY($1::bigint[]);
+"""
+
+QUERY_PEEK_CUSTOM_REMINDER = """
+SELECT uid, target
+    FROM custom_reminder
+ORDER BY target
+LIMIT 1;
+"""
+QUERY_POP_CUSTOM_REMINDER = """
+DELETE FROM custom_reminder
+WHERE uid = $1
+RETURNING userid, channelid, created_ts, message;
 """
 
+# how long the reminder loop trusts NOTIFY alone before peeking again
+_PEEK_INTERVAL = 60.0
+
+# create_pool arguments that asyncpg.connect doesn't accept
+_POOL_ONLY_OPTIONS = frozenset({"min_size", "max_size", "max_queries", "max_inactive_connection_lifetime", "setup", "init", "reset"})
+
+
+def _next_reset(tz: datetime.tzinfo, after: datetime.datetime) -> datetime.datetime:
+    local = after.astimezone(tz)
+    reset = local.replace(hour=4, minute=0, second=0, microsecond=0)
+    if reset <= local:
+        reset += datetime.timedelta(days=1)
+    return reset
+
 
 class Timers(commands.Cog):
     def __init__(self, bot: Kamisato):
         self.bot = bot
-        self.daily_timer_america.start()
-        self.daily_timer_asia.start()
-        self.daily_timer_europe.start()
+        self._reset_task = self.bot.loop.create_task(self._unified_scheduler())
+        # bounds the reset fan-out so a big server doesn't burst the global rate limit
+        self._send_sem = asyncio.Semaphore(10)
 
         self._custom_reminder_task: asyncio.Task[None] | None = None
         self._latest_reminder: datetime.datetime | None = None
-        self._custom_reminder_active = asyncio.Event()
+        # doubled on every connection failure up to 30s, reset once the database answers again
+        self._reconnect_delay = 0.1
+
+        # set by the custom_reminder insert trigger via NOTIFY
+        self._reminder_notify = asyncio.Event()
+        self._listener_conn: asyncpg.Connection[asyncpg.Record] | None = None
 
         self._ensure_reminder_loop()
 
+    async def cog_load(self) -> None:
+        await self._listen()
+
+    async def _listen(self) -> None:
+        # a dedicated connection, so LISTEN never pins a pool slot and the pool can close without waiting on us
+        options = {k: v for k, v in self.bot.config["postgresql"].items() if k not in _POOL_ONLY_OPTIONS}
+        self._listener_conn = await asyncpg.connect(**options)  # type: ignore
+        await self._listener_conn.add_listener("reminder_new", self._on_reminder_notify)  # type: ignore
+
     async def cog_unload(self) -> None:
-        self.daily_timer_america.stop()
-        self.daily_timer_asia.stop()
-        self.daily_timer_europe.stop()
+        self._reset_task.cancel()
 
         if self._custom_reminder_task:
             self._custom_reminder_task.cancel()
             self._custom_reminder_task = None
 
-    async def _purge_daily(self, server: str, weekly: bool = False):
-        async with self.bot.db.acquire() as c, c.transaction():
-            await c.execute(QUERY_DELETE_REMINDER.format("daily"), server)
-            if not weekly:
-                return
-            await c.execute(QUERY_DELETE_REMINDER.format("weekly"), server)
+        if self._listener_conn is not None:
+            await self._listener_conn.close()
+            self._listener_conn = None
+
+    def _on_reminder_notify(self, conn: asyncpg.Connection[asyncpg.Record], pid: int, channel: str, payload: str) -> None:
+        self._reminder_notify.set()
+
+    async def _purge_daily(self, server: str, kinds: list[str]):
+        await self.bot.db.execute(QUERY_PURGE_REMINDERS, server, kinds)
 
     async def _temporary_reminder(
         self, *,
@@ -107,107 +172,121 @@ class Timers(commands.Cog):
     async def _reminder_loop(self):
         await self.bot.wait_until_ready()
 
-        if not self._custom_reminder_active.is_set() and  await self.bot.db.fetchval("SELECT 1 FROM custom_reminder LIMIT 1;"):
-            self._custom_reminder_active.set()
-
         try:
             while not self.bot.is_closed():
-                await self._custom_reminder_active.wait()
-                q = """
-                SELECT uid, userid, channelid, created, target, message
-                FROM custom_reminder
-                WHERE expires < (CURRENT_DATE + '40 days'::interval)
-                ORDER BY expires
-                LIMIT 1;
-                """
-                data: tuple[int, int, int, datetime.datetime, datetime.datetime, str] | None = await self.bot.db.fetchrow(q)  # type: ignore
-                if not data:
-                    self._custom_reminder_active.clear()
+                # anything inserted after this point wakes us up again, even if the peek below already saw it
+                self._reminder_notify.clear()
+                peek: tuple[int, datetime.datetime] | None = await self.bot.db.fetchrow(QUERY_PEEK_CUSTOM_REMINDER)  # type: ignore
+                self._reconnect_delay = 0.1
+
+                # a dropped LISTEN connection never notifies again, so re-LISTEN and rely on the peek timeout below meanwhile
+                if self._listener_conn is None or self._listener_conn.is_closed():
+                    try:
+                        await self._listen()
+                    except (OSError, asyncio.TimeoutError, PostgresConnectionError):
+                        self._listener_conn = None
+
+                if not peek:
+                    try:
+                        await asyncio.wait_for(self._reminder_notify.wait(), timeout=_PEEK_INTERVAL)
+                    except asyncio.TimeoutError:
+                        pass
                     continue
                 
-                unique, user_id, channel_id, created_at, target, message = data
+                unique, target = peek
                 self._latest_reminder = target
-                await utils.sleep_until(target)
 
-                async with self.bot.db.acquire() as c, c.transaction():
-                    await c.execute("DELETE FROM custom_reminder WHERE uid=$1;", unique)
+                sleep = asyncio.create_task(utils.sleep_until(target))
+                notified = asyncio.create_task(self._reminder_notify.wait())
+                try:
+                    done, _ = await asyncio.wait({sleep, notified}, timeout=_PEEK_INTERVAL, return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    sleep.cancel()
+                    notified.cancel()
+
+                if sleep not in done:
+                    # a new reminder may be due before this one (or we missed its NOTIFY), so peek again
+                    continue
+
+                # a single statement is atomic, and returns nothing if the reminder was removed while we slept
+                data: tuple[int, int, int, str] | None = await self.bot.db.fetchrow(QUERY_POP_CUSTOM_REMINDER, unique)  # type: ignore
+                if not data:
+                    continue
+
+                user_id, channel_id, created_ts, message = data
                 
                 try:
                     channel: discord.abc.MessageableChannel = self.bot.get_channel(channel_id) or await self.bot.fetch_channel(channel_id)  # type: ignore
                 except discord.HTTPException:
                     continue
-            
-                guild = channel.guild.id if hasattr(channel, 'guild') else '@me'  # type: ignore
 
                 try:
-                    await channel.send(f'<@!{user_id}>, {utils.format_dt(created_at, "R")}: {message}')
+                    await channel.send(f'<@!{user_id}>, <t:{created_ts}:R>: {message}')
                 except discord.HTTPException:
                     continue
         except asyncio.CancelledError:
             raise
         except (OSError, discord.ConnectionClosed, PostgresConnectionError):
+            await asyncio.sleep(self._reconnect_delay)
+            self._reconnect_delay = min(self._reconnect_delay * 2, 30.0)
             self._ensure_reminder_loop()
 
-    async def _daily_callback(self, server: str):
-        rows: list[tuple[int, int]] = await self.bot.db.fetch(QUERY_SELECT_REMINDER.format("daily"), server)  # type: ignore
+    async def _send_reset(self, channel: discord.abc.MessageableChannel, mention_format: str, message: str) -> None:
+        async with self._send_sem:
+            await channel.send(f'{mention_format} {message}')
 
-        for channel_id, group in itertools.groupby(rows, key=lambda t: t[1]):
+    async def _daily_callback(self, server: str, kinds: list[str]):
+        rows: list[tuple[int, list[int]]] = await self.bot.db.fetch(QUERY_SELECT_REMINDERS, server, kinds)  # type: ignore
+        message = _WEEKLY_MSG[server] if "weekly" in kinds else _DAILY_MSG[server]
+        dead: list[int] = []
+        sent: list[int] = []
+        coros: list[Coroutine[Any, Any, None]] = []
+
+        for channel_id, user_ids in rows:
             channel: discord.abc.MessageableChannel | None = self.bot.get_channel(channel_id)  # type: ignore
 
             if channel is None:
-                self.bot.log.error("Failed to send daily reminder as channel id '%s' was not found.", channel_id)
+                self.bot.log.error("Failed to send reset reminder as channel id '%s' was not found.", channel_id)
+                dead.append(channel_id)
+                continue
 
-                async with self.bot.db.acquire() as c, c.transaction():
-                    await c.execute("DELETE FROM daily_reminder WHERE channelid = $1;", channel_id)
+            mention_format = " ".join(map(_fmt_mention, user_ids))
+            sent.append(channel_id)
+            coros.append(self._send_reset(channel, mention_format, message))
 
+        results = await asyncio.gather(*coros, return_exceptions=True)
+        for channel_id, result in zip(sent, results):
+            if isinstance(result, discord.NotFound):
+                dead.append(channel_id)
+            elif isinstance(result, discord.Forbidden):
+                # missing permissions can be fixed by the server, so the reminders are kept
                 continue
+            elif isinstance(result, BaseException):
+                self.bot.log.error("Failed to send reset reminder to channel id '%s'.", channel_id, exc_info=result)
 
-            mention_format = " ".join(f"<@!{k}>" for k, _ in group)
-            await channel.send(f'{mention_format} the {server.title()} server dailies have reset!')
+        if dead:
+            await self.bot.db.execute(QUERY_DELETE_DEAD_CHANNELS, dead)
         
-        await self._purge_daily(server)
+        await self._purge_daily(server, kinds)
 
-    async def _weekly_callback(self, server: str):
-        rows: list[tuple[int, int]] = await self.bot.db.fetch(QUERY_SELECT_REMINDER.format("weekly"), server)  # type: ignore
+    async def _unified_scheduler(self):
+        await self.bot.wait_until_ready()
 
-        for channel_id, group in itertools.groupby(rows, key=lambda t: t[1]):
-            channel: discord.abc.MessageableChannel | None = self.bot.get_channel(channel_id)  # type: ignore
+        # (next local reset, server), the offsets are fixed so a reset is always exactly one day after the last
+        now = utils.utcnow()
+        heap = [(_next_reset(tz, now), server) for server, tz in _RESET_ZONES]
+        heapq.heapify(heap)
 
-            if channel is None:
-                self.bot.log.error("Failed to send weekly reminder as channel id '%s' was not found.", channel_id)
-                async with self.bot.db.acquire() as c, c.transaction():
-                    await c.execute("DELETE FROM weekly_reminder WHERE channelid = $1;", channel_id)
+        while not self.bot.is_closed():
+            when, server = heapq.heappop(heap)
+            await utils.sleep_until(when)
 
-                continue
+            try:
+                await self._daily_callback(server, _WEEKLY_KINDS if when.weekday() == 0 else _DAILY_KINDS)
+            except Exception:
+                self.bot.log.exception("Reset callback for the %s server failed.", server)
 
-            mention_format = " ".join(f"<@!{k}>" for k, _ in group)
-            await channel.send(f'{mention_format} the {server.title()} server weeklies (and dailies) have reset!')
-        
-        await self._purge_daily(server)
-
-    @tasks.loop(time=datetime.time(4, 0, 0, 0, tzinfo=zoneinfo.ZoneInfo("Etc/GMT+5")))
-    async def daily_timer_america(self):
-        weekday = datetime.datetime.now(zoneinfo.ZoneInfo("Etc/GMT+5")).weekday()
-        if weekday == 0:
-            await self._weekly_callback("america")
-        else:
-            await self._daily_callback("america")
-
-    @tasks.loop(time=datetime.time(4, 0, 0, 0, tzinfo=zoneinfo.ZoneInfo("Etc/GMT-8")))
-    async def daily_timer_asia(self):
-        weekday = datetime.datetime.now(zoneinfo.ZoneInfo("Etc/GMT-8")).weekday()
-        if weekday == 0:
-            await self._weekly_callback("asia")
-        else:
-            await self._daily_callback("asia")
-
-    @tasks.loop(time=datetime.time(4, 0, 0, 0, tzinfo=zoneinfo.ZoneInfo("Etc/GMT-1")))
-    async def daily_timer_europe(self):
-        weekday = datetime.datetime.now(zoneinfo.ZoneInfo("Etc/GMT-1")).weekday()
-        if weekday == 0:
-            await self._weekly_callback("europe")
-        else:
-            await self._daily_callback("europe")
+            heapq.heappush(heap, (when + datetime.timedelta(days=1), server))
 
     # --- Commands --- #
 
@@ -221,25 +300,25 @@ class Timers(commands.Cog):
 
         try:
             async with self.bot.db.acquire() as c, c.transaction():
-                server: str = await c.fetchval(
-                    QUERY_INSERT_REMINDER.format("daily"),
-                    interaction.user.id, repeat, interaction.channel_id
+                server: str | None = await c.fetchval(
+                    QUERY_INSERT_REMINDER,
+                    interaction.user.id, "daily", repeat, interaction.channel_id
                 )
-        except ForeignKeyViolationError:
-            await interaction.followup.send(f"Failed to set up a reminder. Make sure you have a server specified via `/server update <region>`")
-            return
         except UniqueViolationError:
-            async with self.bot.db.acquire() as c, c.transaction():
-                await c.execute("DELETE FROM daily_reminder WHERE userid=$1;", interaction.user.id)
+            await self.bot.db.execute(QUERY_DELETE_REMINDER, interaction.user.id, "daily")
 
             await interaction.followup.send("The reminder was cancelled.")
             return
 
+        if server is None:
+            await interaction.followup.send("Failed to set up a reminder. Make sure you have a server specified via `/server update <region>`")
+            return
+
         now = datetime.datetime.now(timezones[server])
         if now.hour > 4:
             now += datetime.timedelta(days=1)
 
-        time_until = datetime.datetime(now.year, now.month, now.day, 4, tzinfo=timezones[server]).astimezone(zoneinfo.ZoneInfo("Etc/UTC"))
+        time_until = now.replace(hour=4, minute=0, second=0, microsecond=0).astimezone(UTC)
         time_format = utils.format_dt(time_until, "R")
 
         await interaction.followup.send(f"Okay, I will mention you when the {server.title()} server resets {time_format}{' every day' if repeat else ''}.")
@@ -252,27 +331,27 @@ class Timers(commands.Cog):
 
         try:
             async with self.bot.db.acquire() as c, c.transaction():
-                server: str = await c.fetchval(
-                    QUERY_INSERT_REMINDER.format("weekly"),
-                    interaction.user.id, repeat, interaction.channel_id
+                server: str | None = await c.fetchval(
+                    QUERY_INSERT_REMINDER,
+                    interaction.user.id, "weekly", repeat, interaction.channel_id
                 )
-        except ForeignKeyViolationError:
-            await interaction.followup.send("Failed to set up a reminder. Make sure you have a server specified via `/server update <region>`")
-            return
         except UniqueViolationError:
-            async with self.bot.db.acquire() as c, c.transaction():
-                await c.execute("DELETE FROM weekly_reminder WHERE userid=$1;", interaction.user.id)
+            await self.bot.db.execute(QUERY_DELETE_REMINDER, interaction.user.id, "weekly")
                 
             await interaction.followup.send("The reminder was cancelled.")
             return
 
+        if server is None:
+            await interaction.followup.send("Failed to set up a reminder. Make sure you have a server specified via `/server update <region>`")
+            return
+
         now = datetime.datetime.now(timezones[server])
-        time_since_monday = 7 - now.weekday()
-        if now.weekday() == 0 and now.hour < 4:  # resets in a few hours
-            time_since_monday = 0
-        now += datetime.timedelta(days=time_since_monday)
+        weekday = now.weekday()
+        # on monday before 4am the reset is still today
+        days_ahead = (7 - weekday) % 7 or (0 if now.hour < 4 else 7)
+        next_day = now + datetime.timedelta(days=days_ahead)
 
-        time_until = datetime.datetime(now.year, now.month, now.day, 4, tzinfo=timezones[server]).astimezone(zoneinfo.ZoneInfo("Etc/UTC"))
+        time_until = next_day.replace(hour=4, minute=0, second=0, microsecond=0).astimezone(UTC)
         time_format = utils.format_dt(time_until, "R")
 
         await interaction.followup.send(f"Okay, I will mention you when the {server.title()} server resets {time_format}{' every week' if repeat else ''}.")
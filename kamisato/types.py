@@ -11,8 +11,10 @@ You should have received a copy of the GNU Affero General Public License along w
 
 from __future__ import annotations
 
-from enum import Enum
-from typing import Any, Literal, TypedDict,TYPE_CHECKING, _TypedDict
+from enum import IntEnum
+from itertools import chain
+from types import MappingProxyType
+from typing import Any, Callable, Literal, Mapping, TypedDict,TYPE_CHECKING
 
 if TYPE_CHECKING:
     ...
@@ -28,29 +30,42 @@ class _ConfigPostgres(TypedDict):
 
 class _ConfigOptional(TypedDict, total=False):
     ssh_tunnel: list[str]
+    sync_all_commands: bool
 
 class Config(_ConfigOptional):
     discord: _ConfigDiscord
     postgresql: _ConfigPostgres
 
 
-class Rarity(int, Enum):
+class BotState(IntEnum):
+    INIT = 0
+    DB_UP = 1
+    READY = 2
+    CLOSING = 3
+
+
+class Rarity(IntEnum):
     grey = 1
     green = 2
     blue = 3
     purple = 4
     gold = 5
 
-    def __str__(self) -> str: return str(self.value)
+    _str: str
+
+    def __str__(self) -> str:
+        return self._str
 
     def get_max_artifact_upgrade_count(self) -> int:
-        if self in {1, 2}:
-            return 0
-        if self == 3:
-            return 1
-        if self == 4:
-            return 3
-        return 5
+        return _MAX_UPGRADES[self.value]
+
+
+for _rarity in Rarity:
+    _rarity._str = str(_rarity.value)
+del _rarity
+
+# indexed by rarity
+_MAX_UPGRADES = (0, 0, 0, 1, 3, 5)
 
 
 artifact_sets = [
@@ -69,7 +84,7 @@ character = [
     "SangonomiyaKokomi"
 ]
 
-main_stats = [
+main_stats = (
     "geo_dmg_",
     "pyro_dmg_",
     "anemo_dmg_",
@@ -85,9 +100,9 @@ main_stats = [
     "enerRech_",
     "critRate_",
     "critDMG_"
-]
+)
 
-sub_stats = [
+sub_stats = (
     "hp",
     "hp_",
     "atk",
@@ -98,11 +113,11 @@ sub_stats = [
     "eleMas",
     "critRate_",
     "critDMG_"
-]
+)
 
-stats = set(main_stats + sub_stats)
+stats: frozenset[str] = frozenset(chain(main_stats, sub_stats))
 
-stat_transform: dict[str, str] = {
+stat_transform: Mapping[str, str] = MappingProxyType({
     "hp": "HP: {0:,.0f}",
     "hp_": "HP: {0:.1f}%",
     "atk": "ATK: {0:,.0f}",
@@ -122,7 +137,10 @@ stat_transform: dict[str, str] = {
     "hydro_dmg_": "Hydro DMG Bonus: {0:.1%}",
     "pyro_dmg_": "Pyro DMG Bonus: {0:.1%}",
     "cryo_dmg_": "Cryo DMG Bonus: {0:.1%}"
-}
+})
+
+# bound str.format methods, so rendering is stat_formatters[key](value)
+stat_formatters: Mapping[str, Callable[[float], str]] = MappingProxyType({k: v.format for k, v in stat_transform.items()})
 
 
 class _ScanData_Artifacts_Artifact_Substat(TypedDict):
@@ -140,7 +158,7 @@ class _ScanData_Artifacts_Artifact(TypedDict):
     slotKey: str
     substats: list[_ScanData_Artifacts_Artifact_Substat]
 
-class ScanData(_TypedDict, total=False):
+class ScanData(TypedDict, total=False):
     artifacts: list[_ScanData_Artifacts_Artifact]
 
 
@@ -174,14 +192,36 @@ class DailyData(TypedDict):
     talent_books: dict[str, dict[str, str]]
 
 
+# (required, required + optional) per TypedDict, filled for this module below and on first use for others
+_TYPE_KEYS: dict[type, tuple[frozenset[str], frozenset[str]]] = {}
+
+
+def _allowed_keys(typ: Any) -> tuple[frozenset[str], frozenset[str]]:
+    try:
+        return _TYPE_KEYS[typ]
+    except KeyError:
+        keys = _TYPE_KEYS[typ] = (typ.__required_keys__, typ.__required_keys__ | typ.__optional_keys__)
+        return keys
+
+
 def conforms(obj: dict[str, Any], typ: Any) -> tuple[bool, set[str]] | None:
-    required = typ.__required_keys__ - obj.keys()
+    allowed_req, allowed_all = _allowed_keys(typ)
+
+    required = allowed_req - obj.keys()
     if required:
         return True, required
     
-    extra = obj.keys() - set([*typ.__required_keys__, *typ.__optional_keys__])
+    extra = obj.keys() - allowed_all
     if extra:
         return False, extra
+    return None
+
+
+# typing.is_typeddict is 3.10+, TypedDict classes are the only ones here carrying __required_keys__
+for _typ in list(globals().values()):
+    if isinstance(_typ, type) and hasattr(_typ, "__required_keys__"):
+        _allowed_keys(_typ)
+del _typ
 
 
 if __name__ == '__main__':
@@ -12,19 +12,30 @@ You should have received a copy of the GNU Affero General Public License along w
 from __future__ import annotations
 
 import asyncio
+import os
+from collections import deque
 from typing import overload, TYPE_CHECKING
 
 import discord
 from discord import ui, utils
 
 if TYPE_CHECKING:
-    from typing import Iterable
+    from typing import Callable, Iterable
     from typing_extensions import Self
 
 
 U200B = "\u200b"
 
 
+# new page index from (current index, page count) for each navigation button
+_PAGE_ACTIONS: dict[str, Callable[[int, int], int]] = {
+    "first": lambda index, count: 0,
+    "prev": lambda index, count: (index - 1) % count,
+    "next": lambda index, count: (index + 1) % count,
+    "last": lambda index, count: count - 1,
+}
+
+
 class ReactivePaginator(ui.View):
     def __init__(self, paginator: Paginator, /, *, allowed_users: set[int] | None = None):
         super().__init__()
@@ -32,8 +43,28 @@ class ReactivePaginator(ui.View):
         self._page_index = 0
         self._message: discord.Message = utils.MISSING
         self._allowed_users = allowed_users
-        if len(paginator.pages) == 1:
-            self.right.disabled = self._end.disabled = True
+
+        # custom ids are namespaced per view so concurrent paginators don't collide
+        self._custom_id_prefix = os.urandom(8).hex()
+        # last written disabled state of the (start, left) and (right, end) pairs
+        self._left_disabled = True
+        self._right_disabled = paginator.page_count == 1
+
+        self._start = self._add_button("first", "\u23ee\ufe0f", disabled=self._left_disabled)
+        self.left = self._add_button("prev", "\u2b05\ufe0f", disabled=self._left_disabled)
+        self.right = self._add_button("next", "\u27a1\ufe0f", disabled=self._right_disabled)
+        self._end = self._add_button("last", "\u23ed\ufe0f", disabled=self._right_disabled)
+        self._stop = self._add_button("stop", "\u23f9\ufe0f", style=discord.ButtonStyle.red)
+
+    def _add_button(
+        self, action: str, emoji: str, *,
+        style: discord.ButtonStyle = discord.ButtonStyle.blurple,
+        disabled: bool = False
+    ) -> ui.Button[Self]:
+        button: ui.Button[Self] = ui.Button(emoji=emoji, style=style, disabled=disabled, custom_id=f"{self._custom_id_prefix}:{action}")
+        button.callback = self._on_button
+        self.add_item(button)
+        return button
 
     async def interaction_check(self, interaction: discord.Interaction) -> bool:
         if self._allowed_users is None:
@@ -41,85 +72,133 @@ class ReactivePaginator(ui.View):
         
         return interaction.user.id in self._allowed_users
 
-    def _rotate(self, dir: int):
-        self._page_index += dir
-        if self._page_index < 0:
-            self._page_index = len(self._paginator.pages) - 1
-        elif self._page_index >= len(self._paginator.pages):
-            self._page_index = 0
-    
-    async def _update_msg(self, interaction: discord.Interaction):
-        self.left.disabled = self._start.disabled = self._page_index == 0
-        self.right.disabled = self._end.disabled = self._page_index == len(self._paginator.pages) -1 
+    async def _update_msg(self, interaction: discord.Interaction, page_count: int):
+        left_disabled = self._page_index == 0
+        if left_disabled is not self._left_disabled:
+            self.left.disabled = self._start.disabled = self._left_disabled = left_disabled
 
-        await interaction.response.edit_message(content=self._paginator.pages[self._page_index], view=self)
+        right_disabled = self._page_index == page_count - 1
+        if right_disabled is not self._right_disabled:
+            self.right.disabled = self._end.disabled = self._right_disabled = right_disabled
 
-    @ui.button(emoji="\u23ee\ufe0f", style=discord.ButtonStyle.blurple, disabled=True)
-    async def _start(self, interaction: discord.Interaction, button: ui.Button[Self]) -> None:
-        self._page_index = 0
-        await self._update_msg(interaction)
-
-    @ui.button(emoji="\u2b05\ufe0f", style=discord.ButtonStyle.blurple, disabled=True)
-    async def left(self, interaction: discord.Interaction, button: ui.Button[Self]) -> None:
-        self._rotate(-1)
-        await self._update_msg(interaction)
+        await interaction.response.edit_message(content=self._paginator.pages[self._page_index], view=self)
 
-    @ui.button(emoji="\u27a1\ufe0f", style=discord.ButtonStyle.blurple)
-    async def right(self, interaction: discord.Interaction, button: ui.Button[Self]) -> None:
-        self._rotate(+1)
-        await self._update_msg(interaction)
+    async def _on_button(self, interaction: discord.Interaction) -> None:
+        action = interaction.data["custom_id"].rpartition(":")[2]  # type: ignore
 
-    @ui.button(emoji="\u23ed\ufe0f", style=discord.ButtonStyle.blurple)
-    async def _end(self, interaction: discord.Interaction, button: ui.Button[Self]) -> None:
-        self._page_index = len(self._paginator.pages) - 1
-        await self._update_msg(interaction)
+        if action == "stop":
+            child: ui.Button[Self]
+            for child in self.children:  # type: ignore
+                child.disabled = True
+            await interaction.response.edit_message(view=self)
+            return
 
-    @ui.button(emoji="\u23f9\ufe0f", style=discord.ButtonStyle.red)
-    async def _stop(self, interaction: discord.Interaction, button: ui.Button[Self]) -> None:
-        child: ui.Button[Self]
-        for child in self.children:  # type: ignore
-            child.disabled = True
-        await interaction.response.edit_message(view=self)
+        n = self._paginator.page_count
+        self._page_index = _PAGE_ACTIONS[action](self._page_index, n)
+        await self._update_msg(interaction, n)
 
 
 class Paginator:
+    __slots__ = (
+        "_pages", "_current_page_parts", "_current_page_len", "_pages_cache",
+        "prefix", "suffix", "max_size", "_prefix_len", "_suffix_len", "_fix_len", "_max_pages"
+    )
+
     def __init__(
         self, *,
         max_size: int = 1990,
         prefix: str | None = None,
-        suffix: str | None = None
+        suffix: str | None = None,
+        max_pages: int | None = None
     ):
-        self._pages: list[str] = []
-        self._current_page: str = ""
+        if max_pages is not None and max_pages < 1:
+            raise ValueError("max_pages must be at least 1")
+
+        # with max_pages only the most recent pages are kept, the open page included, older ones fall off the front
+        self._pages: list[str] | deque[str] = [] if max_pages is None else deque(maxlen=max_pages)
+        self._max_pages = max_pages
+        # joined only when a page is emitted
+        self._current_page_parts: list[str] = []
+        self._current_page_len = 0
+        # snapshot of pages, reset whenever the paginator is written to
+        self._pages_cache: tuple[str, ...] | None = None
 
         self.prefix = prefix
         self.suffix = suffix
         self.max_size = max_size
 
-    def _into_fix(self, value: str | None = None) -> str:
-        return f'{self.prefix or ""}{value or self._current_page or U200B}{self.suffix or ""}'
+        # page sizes are tracked as integers so append never rebuilds the page to measure it
+        self._prefix_len = len(prefix or "")
+        self._suffix_len = len(suffix or "")
+        self._fix_len = self._prefix_len + self._suffix_len
+
+    def _into_fix(self) -> str:
+        return f'{self.prefix or ""}{"".join(self._current_page_parts) or U200B}{self.suffix or ""}'
 
     @property
     def pages(self) -> tuple[str, ...]:
-        if self._current_page:
-            return tuple(self._pages + [self._into_fix()])
-        return tuple(self._pages)
+        if self._pages_cache is not None:
+            return self._pages_cache
+
+        if self._current_page_parts:
+            pages = (*self._pages, self._into_fix())
+            if self._max_pages is not None:
+                pages = pages[-self._max_pages:]
+            self._pages_cache = pages
+        else:
+            self._pages_cache = tuple(self._pages)
+        return self._pages_cache
+
+    @property
+    def page_count(self) -> int:
+        count = len(self._pages) + (1 if self._current_page_parts else 0)
+        if self._max_pages is not None:
+            return min(count, self._max_pages)
+        return count
 
     def next_page(self):
         self._pages.append(self._into_fix())
-        self._current_page = ""
+        self._current_page_parts.clear()
+        self._current_page_len = 0
+        self._pages_cache = None
 
     def append(self, value: str, /) -> None:
-        if len(self._into_fix(value)) > self.max_size:
+        vlen = len(value)
+        if vlen + self._fix_len > self.max_size:
             raise ValueError("string is outside maximum size (including *fixes")
         
-        if len(self._into_fix(self._current_page + value)) > self.max_size:
+        if self._current_page_len + vlen + self._fix_len > self.max_size:
             self.next_page()
         
-        self._current_page += value
+        self._current_page_parts.append(value)
+        self._current_page_len += vlen
+        self._pages_cache = None
 
     def appendln(self, value: str, /) -> None:
         self.append(value + "\n")
+
+    def extend(self, values: Iterable[str], /) -> None:
+        # same page breaks as calling append for each value, but the length is tracked locally
+        # and written back once
+        limit = self.max_size - self._fix_len
+        parts = self._current_page_parts
+        length = self._current_page_len
+        try:
+            for value in values:
+                vlen = len(value)
+                if vlen > limit:
+                    raise ValueError("string is outside maximum size (including *fixes")
+
+                if length + vlen > limit:
+                    self._current_page_len = length
+                    self.next_page()
+                    length = 0
+
+                parts.append(value)
+                length += vlen
+        finally:
+            self._current_page_len = length
+            self._pages_cache = None
     
     @overload
     def appendlines(self, values: Iterable[str], /) -> None: ...
@@ -128,33 +207,69 @@ class Paginator:
     def appendlines(self, value: str, /, *values: str) -> None: ...
 
     def appendlines(self, value: Iterable[str] | str, /, *values: str):
+        # kept for compatibility, callers that know their argument shape should use extend or appendlines_args
         if isinstance(value, str):
-            self.append(value)
-            for item in values:
-                self.append(item)
+            self.appendlines_args(value, *values)
         else:
-            for item in value:
-                self.append(item)
+            self.extend(value)
+
+    def appendlines_args(self, *values: str) -> None:
+        blob = "".join(values)
+        # one length check when everything fits on the current page, otherwise split per item
+        if self._current_page_len + len(blob) + self._fix_len <= self.max_size:
+            self.append(blob)
+        else:
+            self.extend(values)
 
 
 class MergeStream:
+    __slots__ = ("__process", "__queue", "__pump_task")
+
+    READ_SIZE = 65536
+
     def __init__(self, process: asyncio.subprocess.Process):
         if process.stdout is None or process.stderr is None:
             raise ValueError("stdout and stderr must not be None (did you forget to pass stdout=PIPE?)")
         
         self.__process = process
-        self.__queue: asyncio.Queue[bytes | None] = asyncio.Queue()
-        self.__stdout = asyncio.create_task(self.__stream_task(process.stdout))
-        self.__stderr = asyncio.create_task(self.__stream_task(process.stderr))
-        asyncio.create_task(self.__stop_task())
-
-    async def __stop_task(self):
-        await self.__process.wait()
-        self.__queue.put_nowait(None)
-
-    async def __stream_task(self, stream: asyncio.StreamReader):
-        async for line in stream:
-            await self.__queue.put(line)
+        # bounded so a slow consumer applies backpressure instead of buffering all output
+        self.__queue: asyncio.Queue[str | None] = asyncio.Queue(maxsize=1024)
+        self.__pump_task = asyncio.create_task(self.__pump(process.stdout, process.stderr))
+
+    async def __put_lines(self, data: bytes):
+        for line in data.decode("UTF-8", errors="replace").split("\n"):
+            await self.__queue.put(line.strip())
+
+    async def __pump(self, *streams: asyncio.StreamReader):
+        # one task reads both pipes in large chunks, only complete lines are split off and the rest is carried over
+        tails = dict.fromkeys(streams, b"")
+        pending = {asyncio.ensure_future(stream.read(self.READ_SIZE)): stream for stream in streams}
+
+        try:
+            while pending:
+                done, _ = await asyncio.wait(pending.keys(), return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    stream = pending.pop(future)
+                    chunk = future.result()
+
+                    if not chunk:
+                        if tails[stream]:
+                            await self.__put_lines(tails[stream])
+                        continue
+
+                    complete, newline, tails[stream] = (tails[stream] + chunk).rpartition(b"\n")
+                    if newline:
+                        await self.__put_lines(complete)
+
+                    pending[asyncio.ensure_future(stream.read(self.READ_SIZE))] = stream
+
+            await self.__process.wait()
+        finally:
+            for future in pending:
+                future.cancel()
+
+            # always end the iteration, __anext__ re-raises whatever stopped the pump
+            await self.__queue.put(None)
     
     def __aiter__(self) -> MergeStream:
         return self
@@ -162,8 +277,7 @@ class MergeStream:
     async def __anext__(self) -> str:
         item = await self.__queue.get()
         if item is None:
-            self.__stdout.cancel()
-            self.__stderr.cancel()
+            await self.__pump_task
 
             raise StopAsyncIteration
-        return item.decode("UTF-8").strip()
\ No newline at end of file
+        return item
\ No newline at end of file
@@ -22,22 +22,66 @@ CREATE TABLE IF NOT EXISTS artifact_substats (
     rolls SMALLINT[] NOT NULL
 );
 
+-- guildid 0 holds the global commands
+CREATE TABLE IF NOT EXISTS command_sync (
+    guildid BIGINT PRIMARY KEY,
+    hash TEXT NOT NULL
+);
+
 CREATE TABLE IF NOT EXISTS user_config (
     userid BIGINT PRIMARY KEY UNIQUE NOT NULL,
     server TEXT NOT NULL
 );
 
-CREATE TABLE IF NOT EXISTS daily_reminder (
-    userid BIGINT UNIQUE REFERENCES user_config ON DELETE CASCADE,
+-- daily and weekly reset reminders, server is a copy of user_config.server kept in sync by user_config_sync_server
+CREATE TABLE IF NOT EXISTS reminders (
+    userid BIGINT REFERENCES user_config ON DELETE CASCADE,
+    kind TEXT NOT NULL CHECK (kind IN ('daily', 'weekly')),
     repeat BOOLEAN NOT NULL DEFAULT FALSE,
-    channelid BIGINT NOT NULL
+    channelid BIGINT NOT NULL,
+    server TEXT NOT NULL,
+    PRIMARY KEY (userid, kind)
 );
 
-CREATE TABLE IF NOT EXISTS weekly_reminder (
-    userid BIGINT UNIQUE REFERENCES user_config ON DELETE CASCADE,
-    repeat BOOLEAN NOT NULL DEFAULT FALSE,
-    channelid BIGINT NOT NULL
-);
+CREATE INDEX IF NOT EXISTS reminders_server_idx ON reminders (server, kind);
+
+-- folds the old per-kind tables into reminders
+DO $$
+BEGIN
+    IF to_regclass('daily_reminder') IS NOT NULL THEN
+        INSERT INTO reminders (userid, kind, repeat, channelid, server)
+        SELECT daily_reminder.userid, 'daily', daily_reminder.repeat, daily_reminder.channelid, user_config.server
+            FROM daily_reminder
+        INNER JOIN user_config
+            ON user_config.userid = daily_reminder.userid
+        ON CONFLICT DO NOTHING;
+        DROP TABLE daily_reminder;
+    END IF;
+
+    IF to_regclass('weekly_reminder') IS NOT NULL THEN
+        INSERT INTO reminders (userid, kind, repeat, channelid, server)
+        SELECT weekly_reminder.userid, 'weekly', weekly_reminder.repeat, weekly_reminder.channelid, user_config.server
+            FROM weekly_reminder
+        INNER JOIN user_config
+            ON user_config.userid = weekly_reminder.userid
+        ON CONFLICT DO NOTHING;
+        DROP TABLE weekly_reminder;
+    END IF;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION sync_reminder_server() RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE reminders SET server = NEW.server WHERE userid = NEW.userid;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS user_config_sync_server ON user_config;
+CREATE TRIGGER user_config_sync_server
+    AFTER UPDATE OF server ON user_config
+    FOR EACH ROW WHEN (OLD.server IS DISTINCT FROM NEW.server)
+    EXECUTE PROCEDURE sync_reminder_server();
 
 CREATE TABLE IF NOT EXISTS custom_reminder (
     uid SERIAL PRIMARY KEY UNIQUE NOT NULL,
@@ -45,7 +89,26 @@ CREATE TABLE IF NOT EXISTS custom_reminder (
     channelid BIGINT NOT NULL,
     message TEXT NOT NULL DEFAULT '...',
     target TIMESTAMP NOT NULL,
-    created TIMESTAMP NOT NULL DEFAULT (NOW() AT TIME ZONE 'utc')
+    created TIMESTAMP NOT NULL DEFAULT (NOW() AT TIME ZONE 'utc'),
+    created_ts BIGINT NOT NULL DEFAULT EXTRACT(EPOCH FROM NOW())::bigint
 );
 
-CREATE INDEX IF NOT EXISTS custom_reminder_target_idx ON custom_reminder (target);
\ No newline at end of file
+-- unix seconds of created, so the reminder loop can format it without touching datetimes
+ALTER TABLE custom_reminder ADD COLUMN IF NOT EXISTS created_ts BIGINT;
+UPDATE custom_reminder SET created_ts = EXTRACT(EPOCH FROM created)::bigint WHERE created_ts IS NULL;
+ALTER TABLE custom_reminder ALTER COLUMN created_ts SET DEFAULT EXTRACT(EPOCH FROM NOW())::bigint;
+ALTER TABLE custom_reminder ALTER COLUMN created_ts SET NOT NULL;
+
+CREATE INDEX IF NOT EXISTS custom_reminder_target_idx ON custom_reminder (target);
+
+CREATE OR REPLACE FUNCTION notify_custom_reminder() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('reminder_new', NEW.uid::text);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS custom_reminder_notify ON custom_reminder;
+CREATE TRIGGER custom_reminder_notify
+    AFTER INSERT ON custom_reminder
+    FOR EACH ROW EXECUTE PROCEDURE notify_custom_reminder();